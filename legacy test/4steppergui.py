@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
 
-from numpy import * #for generating scan parameters
-import random #for repeatability tests
+import numpy as np #for generating scan parameters
 import time
 import math
 import os
 import tkinter as tk #contains GUI, can be removed if converted to headless
-from tkinter import font
+import tkinter.font #for tk.font.Font
 from tkinter import filedialog
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError): #RuntimeError is RPi.GPIO saying this isn't a Pi
+    GPIO = None #fine for DefineScan and friends, init_hardware complains
+try:
+    import pigpio #DMA timed step pulses. Needs the daemon running: sudo pigpiod
+except ImportError:
+    pigpio = None
 import subprocess #For taking a picture with fswebcam
 import sys
 import select #for timeouts and buzzing when usb gets disconnect
-import pickle #for saving scan data and resuming
+import json #for saving scan data and resuming
+import logging
+import logging.handlers #QueueHandler/QueueListener, see start_logging
+from dataclasses import dataclass, asdict #ScanConfig
+import multiprocessing as mp #camera + disk work in its own process while the motors move
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor #capture retries wait on a thread so the gui doesn't freeze
+
+try:
+    from picamera2 import Picamera2 #keeps the camera open for a whole scan instead of starting fswebcam every picture
+except ImportError:
+    Picamera2 = None #fswebcam it is
 
-GPIO.setmode(GPIO.BOARD) #IMPORTANT! Physical pin layout
+try:
+    from numba import njit, prange #fills really big scans in one pass, see DefineScan
+except ImportError:
+    njit = None #numpy version works fine, just uses more memory
+    prange = range
 
      #Distances from home position in steps for each motor. 
 #Starts at "0" so if you don't have any switches just move them there before running the program. 
@@ -40,6 +63,20 @@ ZScanStep = 1 #a good default is 500, but this makes it easier to run simple sca
 RScanNumber = 1 #number of rotations per scan, 1 = no rotation. Naming scheme holdoff, will be fixed later
 
 FactorsOf160 = [1,2,4,5,8,10,16,20,32,40,80,160] #for drop down menu of rotations of R since 20 step motor with 8th micro
+_RSTEP = {n: 160 // n for n in FactorsOf160} #steps R moves between views, for each choice in the dropdown. All exact
+RScanStep = _RSTEP[RScanNumber] #kept in step with RScanNumber by SetR
+
+#restart file, HARDCODED ONTO DESKTOP because the auto restart cron script needs to know where to look.
+#only the scan settings and how far we got, the points themselves just get made again by DefineScan
+SCAN_DATA_FILE = '/home/pi/Desktop/ladybug/scandata.json'
+SCAN_DATA_OLD_FILE = '/home/pi/Desktop/ladybug/scandataold.json' #finished scans get renamed to this
+FAILURE_LOG_FILE = '/home/pi/Desktop/ladybug/failures.log' #one line per failed picture (name, time), only ever appended to
+
+CAPTURE_TIMEOUT = 20 #seconds TakePicture waits on the capture worker before calling it a timeout
+TIMEOUT_BURST = 5 #camera timeouts in a row (well, within TIMEOUT_WINDOW seconds) before we give up and restart
+TIMEOUT_WINDOW = TIMEOUT_BURST*CAPTURE_TIMEOUT + 30 #each timeout already eats CAPTURE_TIMEOUT, plus some slack for moves
+
+NUMBA_MIN_POINTS = 200000 #below this the numpy version is quicker than compiling, and the memory doesn't matter
  
 #begin defining pins for input and output (GPIO.BOARD). These can be changed to fit your setup.
 
@@ -77,6 +114,13 @@ ZBACKWARD = 0
 RFORWARD = 1 #Consider forward as clockwise if looking at your sample if referenced
 RBACKWARD = 0
 
+#pigpio only speaks BCM numbers, so map the BOARD pins above once here
+BOARD_TO_BCM = {3:2, 5:3, 7:4, 8:14, 10:15, 11:17, 12:18, 13:27, 15:22, 16:23, 18:24, 19:10, 21:9, 22:25,
+                23:11, 24:8, 26:7, 27:0, 28:1, 29:5, 31:6, 32:12, 33:13, 35:19, 36:16, 37:26, 38:20, 40:21}
+
+MAX_WAVE_REPEAT = 65535 #wave_chain loop counter is only 16 bits
+MAX_WAVE_STEPS = 2000 #pigpio can only hold so many pulses per wave, so long multi-axis moves go out in chunks
+
 #preset speeds, defined as delay between steps in s.
 
 FASTERER = 0.0003
@@ -86,33 +130,57 @@ SLOW = 0.007
 SLOWER = 0.03
 SLOWERER = 0.06
 
-#Begin GPIO output setup
-
-GPIO.setup(BEEP, GPIO.OUT)
-GPIO.setup(XDIR, GPIO.OUT)
-GPIO.setup(YDIR, GPIO.OUT)
-GPIO.setup(ZDIR, GPIO.OUT)
-GPIO.setup(RDIR, GPIO.OUT)
-GPIO.setup(XSTEP, GPIO.OUT)
-GPIO.setup(YSTEP, GPIO.OUT)
-GPIO.setup(ZSTEP, GPIO.OUT)
-GPIO.setup(RSTEP, GPIO.OUT)
-
-#GPIO input setup for limit switches
-GPIO.setup(YLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) 
-GPIO.setup(XLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) 
-GPIO.setup(ZLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) #no pull up! Direct sense with optical switch.
-
-
-#Start Tkinter GUI window. More Tkinter way below. 
-#May fork to a headless version of this with all Tkinter stuff removed,
-#Since I think it adds a lot of bloat and not too much benefit.
-
-win = tk.Tk()
-myFont = tk.font.Font(family='Helvetica', size=12, weight='bold')
-myBigFont = tk.font.Font(family='Helvetica', size=20,weight='bold')
-font.families()
-
+pi = None #pigpio connection, made in init_hardware. Stays None without the pigpio module
+win = None #Tk window, made in build_gui
+beeper = None #RPi.GPIO PWM on the BEEP pin, made in init_hardware, see beep_async
+_beep_timer = None
+
+def init_hardware():
+    '''sets up all the GPIO and connects to pigpiod. Called from the bottom of the file,
+    so just importing this (say, to try DefineScan on a laptop) doesn't touch any hardware'''
+    
+    global pi
+    global beeper
+    
+    if GPIO is None:
+        raise RuntimeError('RPi.GPIO is needed to run the scanner, is this the Pi?')
+    
+    GPIO.setmode(GPIO.BOARD) #IMPORTANT! Physical pin layout
+    
+    #Begin GPIO output setup
+
+    GPIO.setup(BEEP, GPIO.OUT)
+    GPIO.setup(XDIR, GPIO.OUT)
+    GPIO.setup(YDIR, GPIO.OUT)
+    GPIO.setup(ZDIR, GPIO.OUT)
+    GPIO.setup(RDIR, GPIO.OUT)
+    GPIO.setup(XSTEP, GPIO.OUT)
+    GPIO.setup(YSTEP, GPIO.OUT)
+    GPIO.setup(ZSTEP, GPIO.OUT)
+    GPIO.setup(RSTEP, GPIO.OUT)
+
+    #GPIO input setup for limit switches
+    GPIO.setup(YLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) 
+    GPIO.setup(XLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) 
+    GPIO.setup(ZLimit, GPIO.IN, pull_up_down=GPIO.PUD_UP) #no pull up! Direct sense with optical switch.
+
+    #edge detection on the switches, so homing doesn't have to poll and debounce after every single step
+    GPIO.add_event_detect(XLimit, GPIO.FALLING, bouncetime=50)
+    GPIO.add_event_detect(YLimit, GPIO.FALLING, bouncetime=50)
+    GPIO.add_event_detect(ZLimit, GPIO.FALLING, bouncetime=50)
+    
+    beeper = GPIO.PWM(BEEP, 2.5) #frequency gets set again by every beep_async
+
+    #pigpio setup for the motors. If it isn't installed or pigpiod isn't running we just bit-bang with RPi.GPIO like before
+    if pigpio is None:
+        print('pigpio not installed, stepping with RPi.GPIO instead (slower and jittery)')
+        return
+    pi = pigpio.pi()
+    if pi.connected:
+        for pin in (XDIR, YDIR, ZDIR, RDIR, XSTEP, YSTEP, ZSTEP, RSTEP):
+            pi.set_mode(BOARD_TO_BCM[pin], pigpio.OUTPUT)
+    else:
+        print('pigpiod not running, stepping with RPi.GPIO instead (slower and jittery)')
 
 #Begin defining scanner guts
 
@@ -124,31 +192,48 @@ def beep(duration = 0.2, repeat = 1):
         GPIO.output(BEEP,GPIO.LOW)
         time.sleep(duration/2)
 
+def _beep_off():
+    beeper.stop()
+    GPIO.output(BEEP,GPIO.LOW)
+
+def beep_async(on = 0.2, off = 0.2, repeat = 1):
+    '''same as beep but doesn't wait around. RPi.GPIO's PWM thread does the toggling and a timer stops it
+    after the last beep. Not a pigpio wave, the next motor move would cut that off'''
+    
+    global _beep_timer
+    
+    if _beep_timer is not None: #new beep replaces whatever is still going
+        _beep_timer.cancel()
+    beeper.ChangeFrequency(1/(on + off))
+    beeper.start(100*on/(on + off))
+    _beep_timer = threading.Timer(repeat*(on + off) - off, _beep_off)
+    _beep_timer.start()
+
+def beep_hold(on):
+    '''steady buzzer, on until beep_hold(False). Kills any beep_async first, otherwise its timer turns this off early'''
+    
+    global _beep_timer
+    
+    if _beep_timer is not None:
+        _beep_timer.cancel()
+        _beep_timer = None
+    beeper.stop()
+    GPIO.output(BEEP, GPIO.HIGH if on else GPIO.LOW)
+
 def ExampleScan():
     #rotation acting strange!
-    ScanCoord = DefineScan(800,1000,1000,1200)
-    GridScan(ScanCoord)
+    GridScan(ScanConfig(800,1000,1000,1200))
 
 def DemoMove(speed=1,delay = 1):
     #moves motors in a sequence for demo purposes
     #speed is multiplier, delay in seconds between routines
-    for i in range(700):
-        MoveX(XFORWARD,2,FASTERER/speed)
-        MoveY(YFORWARD,2,FASTERER/speed)
-        MoveZ(ZFORWARD,4,FASTERER/speed)
-        if i%5 == 0:
-            
-            MoveR(RFORWARD,2,FASTERER/speed)
+    MoveXYZ(1400,1400,2800,FASTERER/speed) #all three at once, diagonal
+    MoveR(RFORWARD,280,FASTERER/speed)
 
     time.sleep(delay/2)
     
-    for i in range(700):
-        MoveX(XBACKWARD,2,FASTERER/speed)
-        MoveY(YBACKWARD,2,FASTERER/speed)
-        MoveZ(ZBACKWARD,4,FASTERER/speed)
-        if i%5 == 0:
-            
-            MoveR(RBACKWARD,2,FASTERER/speed)
+    MoveXYZ(-1400,-1400,-2800,FASTERER/speed)
+    MoveR(RBACKWARD,280,FASTERER/speed)
             
     time.sleep(delay)
     
@@ -185,23 +270,347 @@ def DemoMove(speed=1,delay = 1):
     HomeY()
     beep(0.25,2)
     
+log = logging.getLogger(__name__) #just ours, so picamera2 and friends don't get their debug spam turned on too
+_log_listener = None #background thread writing log records out, made in start_logging
+
+def start_logging():
+    '''log calls just drop the record on a queue and a background thread writes it to the terminal,
+    so a slow terminal never holds up the scan (or the restart)'''
+    
+    global _log_listener
+    
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+    
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.DEBUG) #the checkpoint messages are debug, and you want them if sitting there
+    log.propagate = False #already printed, the root logger doesn't need to see it again
+
 def restart(): #restart whole pi
-    command = "/usr/bin/sudo /sbin/shutdown -r now"
-    process = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-    output = process.communicate()[0]
-    print(output)
+    if _log_listener is not None: #write out whatever is still queued, exec doesn't wait for threads
+        _log_listener.stop()
+    sys.stdout.flush() #exec doesn't flush either, and the last prints are the ones that say what went wrong
+    sys.stderr.flush()
+    #we're going down anyway, so just become the shutdown command. No pipe, no waiting on it
+    os.execvp("/usr/bin/sudo", ["/usr/bin/sudo", "/sbin/shutdown", "-r", "now"])
+
+def precise_sleep(dt):
+    '''time.sleep can be ~100us off, which is a third of FASTERER. So sleep most of a long delay
+    and spin on perf_counter for the rest (or all of it if it's short). Only for the non-pigpio fallback'''
+    end = time.perf_counter() + dt
+    if dt > 0.002:
+        time.sleep(dt - 0.001)
+    while time.perf_counter() < end:
+        pass
 
-def MoveX(direction,numsteps,delay):
-    '''parent function for moving x. Just sets direction pin,
-    then flips step pin high and low with delay  '''
+def _move(step_pin, dir_pin, direction, numsteps, delay):
+    '''sets direction pin and sends numsteps pulses on the step pin, delay seconds per step.
+    With pigpio one step is built as a tiny wave and repeated in hardware by wave_chain,
+    so the DMA engine does the timing while python just sleeps until it's done'''
+    
+    if numsteps <= 0:
+        return
+    
+    if pi is None or not pi.connected: #old way. Locals so the loop doesn't look up GPIO.output etc. every step
+        _out, _hi, _lo, _sleep = GPIO.output, GPIO.HIGH, GPIO.LOW, precise_sleep
+        _out(dir_pin, direction)
+        for _ in range(numsteps):
+            _out(step_pin, _hi)
+            _sleep(delay)
+            _out(step_pin, _lo)
+        return
+    
+    pi.write(BOARD_TO_BCM[dir_pin], direction)
+    
+    mask = 1 << BOARD_TO_BCM[step_pin]
+    half_us = max(1, int(delay*1000000/2)) #high for half the delay, low for the other half
+    
+    pi.wave_clear()
+    pi.wave_add_generic([pigpio.pulse(mask, 0, half_us), pigpio.pulse(0, mask, half_us)])
+    wid = pi.wave_create()
+    
+    remaining = numsteps
+    while remaining > 0:
+        count = min(remaining, MAX_WAVE_REPEAT)
+        pi.wave_chain([255, 0, wid, 255, 1, count & 255, count >> 8]) #loop start, wave, repeat count times
+        time.sleep(count*2*half_us/1000000) #nothing to do while it steps
+        while pi.wave_tx_busy():
+            time.sleep(0.001)
+        remaining -= count
+        
+    pi.wave_delete(wid)
+
+def _move_together(axes, delay):
+    '''like _move but for several motors at once. axes is a list of (step_pin, dir_pin, direction, numsteps).
+    The longest axis steps on every tick and the others are spread evenly along it (Bresenham),
+    so a diagonal move only takes as long as its longest axis instead of the sum of all of them'''
+    
+    axes = [axis for axis in axes if axis[3] > 0]
+    if not axes:
+        return
+    longest = max(axis[3] for axis in axes)
+    
+    #which step pins fire on each tick
+    errors = [longest//2 for axis in axes]
+    schedule = []
+    for tick in range(longest):
+        firing = []
+        for n, axis in enumerate(axes):
+            errors[n] += axis[3]
+            if errors[n] >= longest:
+                errors[n] -= longest
+                firing.append(axis[0])
+        schedule.append(firing)
+    
+    if pi is None or not pi.connected: #old way, just all the pins of a tick at once
+        _out, _hi, _lo, _sleep = GPIO.output, GPIO.HIGH, GPIO.LOW, precise_sleep
+        for axis in axes:
+            _out(axis[1], axis[2])
+        for firing in schedule:
+            _out(firing, _hi)
+            _sleep(delay)
+            _out(firing, _lo)
+        return
+    
+    for axis in axes:
+        pi.write(BOARD_TO_BCM[axis[1]], axis[2])
+    
+    half_us = max(1, int(delay*1000000/2))
+    
+    for start in range(0, longest, MAX_WAVE_STEPS):
+        pulses = []
+        for firing in schedule[start:start + MAX_WAVE_STEPS]:
+            mask = 0
+            for pin in firing:
+                mask |= 1 << BOARD_TO_BCM[pin]
+            pulses.append(pigpio.pulse(mask, 0, half_us))
+            pulses.append(pigpio.pulse(0, mask, half_us))
+        
+        pi.wave_clear()
+        pi.wave_add_generic(pulses)
+        wid = pi.wave_create()
+        pi.wave_send_once(wid)
+        time.sleep(len(pulses)*half_us/1000000)
+        while pi.wave_tx_busy():
+            time.sleep(0.001)
+        pi.wave_delete(wid)
+
+def OpenCamera(resolution):
+    '''opens one Picamera2 session for the whole scan. Returns None if picamera2 isn't installed
+    or can't find a camera, in which case capture_worker falls back to fswebcam'''
+    
+    if Picamera2 is None:
+        return None
     
-    GPIO.output(XDIR, direction)
+    try:
+        cam = Picamera2()
+        width, height = (int(n) for n in resolution.split("x"))
+        cam.configure(cam.create_still_configuration(main={"size":(width, height)}))
+        cam.start()
+    except (RuntimeError, IndexError) as e: #IndexError means no camera found at all
+        print('Picamera2 could not open the camera: {}'.format(e))
+        return None
+    
+    return cam
+
+def FswebcamPicture(path, resolution):
+    '''the old way, one fswebcam process per picture. Returns whether it worked.
+    Can raise subprocess.TimeoutExpired if it lags'''
+    
+    proc = subprocess.Popen(["fswebcam", "-r", resolution, "--no-banner", path, "-q"], 
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) #-q means nothing to read anyway
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.terminate() #corrective measure?
+        raise
+    
+    return proc.returncode == 0 #fswebcam fails with nonzero if it couldn't grab a frame
+
+def capture_worker(task_q, done_q, resolution):
+    '''runs in its own process for a whole scan and owns the camera. For every (i, path) it grabs a frame,
+    tells GridScan how it went ('ok', 'missing' or 'timeout') so the motors can go on to the next point,
+    and only then does the JPEG encoding and disk write. If that write fails it says (i, 'write_failed')
+    afterwards so the picture gets taken again. None means stop.'''
+    
+    for handler in log.handlers[:]: #forked with start_logging's QueueHandler but not its listener thread,
+        log.removeHandler(handler) #so anything logged here would just pile up in a queue nobody empties
+    
+    cam = OpenCamera(resolution)
+    picamera = cam is not None
+    if not picamera:
+        print('taking pictures with fswebcam')
+    
+    for i, path in iter(task_q.get, None):
+        
+        if not picamera:
+            try:
+                done_q.put((i, 'ok' if FswebcamPicture(path, resolution) else 'missing'))
+            except subprocess.TimeoutExpired:
+                done_q.put((i, 'timeout'))
+            continue
         
-    for i in range(numsteps):
+        if cam is None: #lost it last time, hopefully it got plugged back in 
+            cam = OpenCamera(resolution)
+            if cam is None:
+                done_q.put((i, 'missing'))
+                continue
+        
+        try:
+            image = cam.capture_image("main")
+        except RuntimeError: #an open session doesn't survive the camera being replugged
+            cam.close()
+            cam = None
+            done_q.put((i, 'missing'))
+            continue
+        
+        done_q.put((i, 'ok')) #picture is taken, motors can move on
+        try:
+            image.save(path)
+        except OSError as e: #disk full, flash drive pulled out... don't take the whole worker down with it
+            print('could not write {}: {}'.format(path, e))
+            done_q.put((i, 'write_failed'))
+    
+    if cam is not None:
+        cam.stop()
+        cam.close()
+
+def StartCaptureWorker(resolution):
+    '''starts capture_worker once per scan. Returns the process and its two queues'''
+    
+    task_q = mp.Queue(maxsize=4) #back-pressure if the disk falls behind
+    done_q = mp.Queue()
+    worker = mp.Process(target=capture_worker, args=(task_q, done_q, resolution), daemon=True)
+    worker.start()
+    return (worker, task_q, done_q)
+
+def StopCaptureWorker(capture):
+    '''tells capture_worker to finish up and waits for it, killing it if the camera is hung'''
+    worker, task_q, done_q = capture
+    try:
+        task_q.put(None, timeout=CAPTURE_TIMEOUT)
+        worker.join(CAPTURE_TIMEOUT) #lets the last picture finish writing
+    except queue.Full: #stuck on the camera behind a full queue, it'll never get to the None
+        pass
+    if worker.is_alive():
+        print('capture worker is stuck, killing it. Check the last few pictures')
+        worker.terminate()
+        worker.join()
+    while True: #the last few writes can still fail after their picture was taken
+        try:
+            j, status = done_q.get_nowait()
+        except queue.Empty:
+            break
+        if status == 'write_failed':
+            lost_pics.append(j)
+
+lost_pics = [] #pictures that got taken but never made it to the disk, GridScan goes back for them
+
+def TakePicture(capture, i, path):
+    '''asks the capture worker for picture i and waits until it's been taken (not written). 
+    Returns whether it worked, raises subprocess.TimeoutExpired if the camera lags, same as fswebcam used to'''
+    
+    worker, task_q, done_q = capture
+    if not worker.is_alive(): #crashed, treat it like the camera being gone so the restart logic kicks in
+        return False
+    try:
+        task_q.put((i, path), timeout=CAPTURE_TIMEOUT) #queue stays full if the worker is stuck writing
+    except queue.Full:
+        raise subprocess.TimeoutExpired("capture_worker", CAPTURE_TIMEOUT)
+    
+    deadline = time.monotonic() + CAPTURE_TIMEOUT #monotonic, an NTP jump shouldn't make us give up (or wait forever)
+    while True:
+        try:
+            j, status = done_q.get(timeout=deadline - time.monotonic())
+        except (queue.Empty, ValueError): #ValueError for a negative timeout
+            raise subprocess.TimeoutExpired("capture_worker", CAPTURE_TIMEOUT)
+        if status == 'write_failed': #comes in after that picture's 'ok', so never the one we're waiting for
+            lost_pics.append(j)
+        elif j == i: #anything else is a late answer for a picture we already gave up on
+            break
+    
+    if status == 'timeout':
+        raise subprocess.TimeoutExpired("fswebcam", 10)
+    return status == 'ok'
+
+abort_event = threading.Event() #set by the ABORT SCAN button, GridScan and capture_with_retry both check it
+
+def capture_with_retry(capture, i, path, timeallowed):
+    '''takes picture i, giving you timeallowed seconds to fix the USB twice before giving up. Runs on GridScan's
+    worker thread. Returns True if it worked, False if we should checkpoint and restart, None if the scan got aborted.
+    Lets subprocess.TimeoutExpired through like TakePicture'''
+    
+    name = os.path.basename(path)
+    for w in range(3): #try to take pic
+        
+        if TakePicture(capture, i, path):
+            if w > 0: #AKA, USB was broken but fixed in time
+                print ('Okay thanks bozo. Restarting with {}'.format(name))
+            return True
+        
+        if w <= 1: #usb got unplugged aaaaggghhhhh
+            print('HEY BOZO THE USB GOT UNPLUGGED UNPLUG IT AND PLUG IT BACK IN WITHIN {} SECONDS OR WE REBOOT'.format(timeallowed))
+            print('check if {} failed'.format(name))
             
-            GPIO.output(XSTEP, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(XSTEP, GPIO.LOW)
+            beep_hold(True) #beep and bibrate
+            abort_event.wait(timeallowed) #wakes up early if someone hits abort
+            beep_hold(False)
+            
+            if abort_event.is_set():
+                return None
+    return False
+
+def _wait_for(future):
+    '''waits for a capture_with_retry future while keeping the gui alive, so the abort button still works'''
+    
+    while not future.done():
+        if win is not None:
+            win.update()
+        time.sleep(0.02)
+    return future.result() #re-raises whatever the thread raised
+
+def AbortScan():
+    print("Abort button pressed, stopping after this picture")
+    abort_event.set()
+
+_pending_pos_update = False #position labels get redrawn at most every 0.1 s, see schedule_pos_update
+_last_pos_update = 0.0
+
+def _flush_pos_update():
+    global _pending_pos_update
+    global _last_pos_update
+    
+    _pending_pos_update = False
+    _last_pos_update = time.monotonic()
+    XPosVar.set(f"X: {GlobalX}/{XMax}")
+    YPosVar.set(f"Y: {GlobalY}/{YMax}")
+    ZPosVar.set(f"Z: {GlobalZ}/{ZMax}")
+
+def schedule_pos_update():
+    '''asks for the X/Y/Z labels to show the current position. Everything asked for in the same 0.1 s
+    gets done in one go, since GridScan moves thousands of times and every configure is a Tk relayout'''
+    global _pending_pos_update
+    
+    if win is None: #no gui, say moving things from a python shell without build_gui
+        return
+    if _pending_pos_update: #already on its way
+        return
+    _pending_pos_update = True
+    
+    wait = 0.1 - (time.monotonic() - _last_pos_update)
+    if wait > 0:
+        win.after(int(wait*1000) + 1, _flush_pos_update)
+    else:
+        win.after_idle(_flush_pos_update)
+
+def MoveX(direction,numsteps,delay):
+    '''parent function for moving x. Just hands the direction and step count
+    to _move, then updates the position  '''
+    
+    _move(XSTEP, XDIR, direction, numsteps, delay)
     
     global GlobalX
     
@@ -210,7 +619,7 @@ def MoveX(direction,numsteps,delay):
     else:
         GlobalX -= numsteps
     
-    XPosition.configure(text="X: "+str(GlobalX) + "/" + str(XMax)) 
+    schedule_pos_update() 
     #updates the global position on the screen. Get rid of this if headless!
     
 def XGoTo(XDest, XMin=0):
@@ -236,13 +645,7 @@ def XGoTo(XDest, XMin=0):
 def MoveY(direction,numsteps,delay):
     '''parent function for Y. '''
     
-    GPIO.output(YDIR, direction)    
-        
-    for i in range(numsteps):
-            
-        GPIO.output(YSTEP, GPIO.HIGH)
-        time.sleep(delay)
-        GPIO.output(YSTEP, GPIO.LOW)        
+    _move(YSTEP, YDIR, direction, numsteps, delay)
     
     global GlobalY
     
@@ -250,7 +653,7 @@ def MoveY(direction,numsteps,delay):
         GlobalY += numsteps
     else:
         GlobalY -= numsteps
-    YPosition.configure(text="Y: "+str(GlobalY) + "/" +str(YMax)) #REMOVE IF CONVERTING TO HEADLESS WITHOUT GUI
+    schedule_pos_update() #REMOVE IF CONVERTING TO HEADLESS WITHOUT GUI
     
 def YGoTo(YDest, YMin=0):
     """checks the place is valid and then calls MoveY appropriately."""
@@ -273,21 +676,14 @@ def MoveZ(direction,numsteps,delay):
     '''parent function for Z. This version has no sleep pin enable/disable:
     Be careful to use a low voltage and amount of current! Otherwise small motors like this will get hot!'''
     
-    GPIO.output(ZDIR, direction)
+    _move(ZSTEP, ZDIR, direction, numsteps, delay)
     global GlobalZ
-         
-    for i in range(numsteps):
-            
-        GPIO.output(ZSTEP, GPIO.HIGH)
-        time.sleep(delay)    
-        GPIO.output(ZSTEP, GPIO.LOW)        
-        
     
     if direction == ZFORWARD: 
         GlobalZ += numsteps
     else:
         GlobalZ -= numsteps
-    ZPosition.configure(text="Z: "+str(GlobalZ) + "/" + str(ZMax))
+    schedule_pos_update()
 
 def ZGoTo(ZDest, ZMin=0):
     """checks the place is valid and then calls MoveZ appropriately.
@@ -311,18 +707,18 @@ def ZGoTo(ZDest, ZMin=0):
 
 def MoveR(direction,numsteps,delay):
 
-    GPIO.output(RDIR, direction)
+    _move(RSTEP, RDIR, direction, numsteps, delay)
     global GlobalR
     
-    for i in range(numsteps):
-        GPIO.output(RSTEP, GPIO.HIGH)
-        time.sleep(delay)
-        GPIO.output(RSTEP,GPIO.LOW)
-    
-    '''Count information like the others could be inserted here. 
-    But we don't really have a way to define our "zero", except for wherever it is when we start the scan,
+    '''We don't really have a way to define our "zero", except for wherever it is when we start the scan,
     which is problematic because what if we restart with our R in a different place? 
-    If there are undiscovered problems, I think they would revolved around this area. FYI. '''
+    If there are undiscovered problems, I think they would revolved around this area. FYI. 
+    Still need to count though, otherwise RGoTo keeps spinning by the full distance every point.'''
+    
+    if direction == RFORWARD:
+        GlobalR += numsteps
+    else:
+        GlobalR -= numsteps
 
 def RGoTo(RDest, RMin=0):
     """checks that it's within the proper range and calls MoveR. Note that I just added this because I noticed it was missing. 
@@ -343,58 +739,165 @@ def RGoTo(RDest, RMin=0):
     else:
         print ('I understand the desire to watch the motor spin around a lot... but between {} and {} please'.format(RMin,StepsPerRotation))
               
+def MoveXYZ(dx, dy, dz, delay):
+    '''moves X, Y and Z at the same time by (signed) numbers of steps, in one wave.
+    No range checking here, same as MoveX and friends'''
+    
+    _move_together([(XSTEP, XDIR, XFORWARD if dx > 0 else XBACKWARD, abs(dx)),
+                    (YSTEP, YDIR, YFORWARD if dy > 0 else YBACKWARD, abs(dy)),
+                    (ZSTEP, ZDIR, ZFORWARD if dz > 0 else ZBACKWARD, abs(dz))], delay)
+    
+    global GlobalX
+    global GlobalY
+    global GlobalZ
+    
+    GlobalX += dx
+    GlobalY += dy
+    GlobalZ += dz
+    
+    schedule_pos_update()
+
+def _goto_fast(dest, cur, step_pin, dir_pin, delay=FASTER):
+    '''GoTo without the checks, for points we already trust. Forward is 1 on every axis so the
+    sign of the distance is the direction. Returns the signed distance so the caller can update its Global'''
+    
+    d = dest - cur
+    _move(step_pin, dir_pin, int(d >= 0), abs(d), delay)
+    return d
+    
+def MoveTo(XDest, YDest, ZDest, RDest):
+    '''goes to a scan point, X Y and Z together and then R (which wants to go slower).
+    Meant for GridScan, where DefineScan already kept the points in range, so R skips RGoTo's checks too'''
+    
+    global GlobalR
+    
+    MoveXYZ(XDest - GlobalX, YDest - GlobalY, ZDest - GlobalZ, FASTER)
+    GlobalR += _goto_fast(RDest, GlobalR, RSTEP, RDIR, FAST)
+    
 def CheckPress(PIN):
-    '''checks whether specified GPIO pin has been pressed, since home procedures have to call multiple times'''
-    input_state = GPIO.input(PIN)
-    if input_state == False: #button press
-            time.sleep(0.05) #debounce
-            input_state = GPIO.input(PIN)
-            if input_state == False: #still!
-                return True #yep, button press
-            
+    '''checks whether specified GPIO pin is pressed right now. No debounce sleep anymore,
+    the bouncetime on the edge detection takes care of that'''
+    return GPIO.input(PIN) == False #button press
+
+def _move_until_pressed(step_pin, dir_pin, direction, maxsteps, delay, PIN):
+    '''like _move, but stops as soon as the switch on PIN gets pressed. Returns how many steps that took,
+    or None if it never got pressed. With pigpio the whole run goes out as one wave and we just
+    check for the edge every ms, stopping the wave when it shows up'''
+    
+    if CheckPress(PIN): #already pressed, there won't be an edge
+        return 0
+    GPIO.event_detected(PIN) #clear anything left over from earlier
+    
+    if pi is None or not pi.connected: #old way, but checking the edge flag is a lot cheaper than CheckPress was
+        _out, _hi, _lo, _sleep, _pressed = GPIO.output, GPIO.HIGH, GPIO.LOW, precise_sleep, GPIO.event_detected
+        _out(dir_pin, direction)
+        for i in range(maxsteps):
+            if _pressed(PIN):
+                return i
+            _out(step_pin, _hi)
+            _sleep(delay)
+            _out(step_pin, _lo)
+        return maxsteps if _pressed(PIN) else None
+    
+    pi.write(BOARD_TO_BCM[dir_pin], direction)
+    
+    mask = 1 << BOARD_TO_BCM[step_pin]
+    half_us = max(1, int(delay*1000000/2))
+    count = min(maxsteps, MAX_WAVE_REPEAT)
+    
+    pi.wave_clear()
+    pi.wave_add_generic([pigpio.pulse(mask, 0, half_us), pigpio.pulse(0, mask, half_us)])
+    wid = pi.wave_create()
+    pi.wave_chain([255, 0, wid, 255, 1, count & 255, count >> 8])
+    start = pi.get_current_tick()
+    
+    steps = None
+    while pi.wave_tx_busy():
+        if GPIO.event_detected(PIN):
+            pi.wave_tx_stop()
+            steps = min(count, pigpio.tickDiff(start, pi.get_current_tick()) // (2*half_us)) #steps sent so far
+            break
+        time.sleep(0.001)
+    else:
+        if GPIO.event_detected(PIN): #right on the last step
+            steps = count
+    
+    pi.wave_delete(wid)
+    return steps
+
 def HomeX():
     global GlobalX
-    for i in range(XMax + 200): #some number that's noticably larger than the range, but also will eventually stop in case something goes wrong 
     
-    #check if button is pressed
-        
-        
-        if CheckPress(XLimit): #button pressed once. need to move forward and back again to ensure correct start position
-            MoveX(XFORWARD,300,SLOW) #move forward
-            for j in range(350): #move back and check again
-                if CheckPress(XLimit): #again
-                    
-                
-                    print('Button has been pressed after {} steps!'.format(i))
-                    print('was already homed check: took {} out of 300 steps on the second bounce'.format(j))
-                    GlobalX = 0
-                    XPosition.configure(text="X: " +str(GlobalX) + "/" + str(XMax))
-                    return (i) #break away essentially
-                MoveX(XBACKWARD,1,SLOW)
-            #do stepping protocol (placed second in case button already pressed)
-        MoveX(XBACKWARD,1,FASTER)#dir dis delay
+    i = _move_until_pressed(XSTEP, XDIR, XBACKWARD, XMax + 200, FASTER, XLimit) #some number that's noticably larger than the range, but also will eventually stop in case something goes wrong 
+    if i is None:
+        print('X never hit the switch, check it!')
+        return
+    
+    #button pressed once. need to move forward and back again to ensure correct start position
+    MoveX(XFORWARD,300,SLOW) #move forward
+    j = _move_until_pressed(XSTEP, XDIR, XBACKWARD, 350, SLOW, XLimit) #move back and check again
+    if j is None:
+        print('X switch did not press again on the second bounce, check it!')
+        return
+    
+    print('Button has been pressed after {} steps!'.format(i))
+    print('was already homed check: took {} out of 300 steps on the second bounce'.format(j))
+    GlobalX = 0
+    schedule_pos_update()
+    return (i)
 
 def HomeY():
     global GlobalY
-    for i in range(YMax + 200): #some number that's noticably larger than the range, but also will eventually stop in case something goes wrong 
     
-    #check if button is pressed
-        
-        
-        if CheckPress(YLimit): #button pressed once. need to move forward and back again to ensure correct start position
-            MoveY(YFORWARD,300,SLOW) #move forward
-            for j in range(350): #move back and check again
-                if CheckPress(YLimit): #again
-                    
-                
-                    print('Button has been pressed after {} steps!'.format(i))
-                    print('was already homed check: took {} out of 300 steps on the second bounce'.format(j))
-                    GlobalY = 0
-                    YPosition.configure(text="Y: "+str(GlobalY) + "/" + str(YMax))
-                    return (i) #break away essentially
-                MoveY(YBACKWARD,1,SLOW)
-            #do stepping protocol (placed second in case button already pressed)
-        MoveY(YBACKWARD,1,FASTER)#dir dis delay
+    i = _move_until_pressed(YSTEP, YDIR, YBACKWARD, YMax + 200, FASTER, YLimit) #some number that's noticably larger than the range, but also will eventually stop in case something goes wrong 
+    if i is None:
+        print('Y never hit the switch, check it!')
+        return
+    
+    #button pressed once. need to move forward and back again to ensure correct start position
+    MoveY(YFORWARD,300,SLOW) #move forward
+    j = _move_until_pressed(YSTEP, YDIR, YBACKWARD, 350, SLOW, YLimit) #move back and check again
+    if j is None:
+        print('Y switch did not press again on the second bounce, check it!')
+        return
+    
+    print('Button has been pressed after {} steps!'.format(i))
+    print('was already homed check: took {} out of 300 steps on the second bounce'.format(j))
+    GlobalY = 0
+    schedule_pos_update()
+    return (i)
+
+def HomeXVerified(tolerance=3):
+    '''homes X, then backs off 50 and creeps back onto the switch at SLOW to check it lands in the same place.
+    Another HomeX would start on the switch anyway and only redo the 300 step bounce, this is 100. 
+    Only homes again if the check was off'''
+    global GlobalX
+    
+    if HomeX() is None:
+        return
+    MoveX(XFORWARD,50,SLOW)
+    s2 = _move_until_pressed(XSTEP, XDIR, XBACKWARD, 100, SLOW, XLimit) #SLOW, at FASTER the edge polling alone is a couple steps off
+    if s2 is not None and abs(s2 - 50) <= tolerance:
+        GlobalX = 0
+        schedule_pos_update()
+        return s2
+    print('X home check was off ({} steps instead of 50), homing again'.format(s2))
+    return HomeX()
+
+def HomeYVerified(tolerance=3):
+    '''same as HomeXVerified'''
+    global GlobalY
+    
+    if HomeY() is None:
+        return
+    MoveY(YFORWARD,50,SLOW)
+    s2 = _move_until_pressed(YSTEP, YDIR, YBACKWARD, 100, SLOW, YLimit)
+    if s2 is not None and abs(s2 - 50) <= tolerance:
+        GlobalY = 0
+        schedule_pos_update()
+        return s2
+    print('Y home check was off ({} steps instead of 50), homing again'.format(s2))
+    return HomeY()
 
 def HomeZ():
     
@@ -404,33 +907,65 @@ def HomeZ():
 
     global GlobalZ
     
-    for i in range(ZMax + 500): 
+    i = _move_until_pressed(ZSTEP, ZDIR, ZBACKWARD, ZMax + 500, FAST, ZLimit)
+    if i is None:
+        print('Z never tripped the optical switch, check it!')
+        return
     
-    #check if button is pressed
-        
+    MoveZ(ZFORWARD,1200,FAST) #move forward -- at least 1k b/c neg range
+    j = _move_until_pressed(ZSTEP, ZDIR, ZBACKWARD, 1400, FAST, ZLimit) #move back and check again
+    if j is None:
+        print('Z optical switch did not trip again on the second bounce, check it!')
+        return
     
-        if CheckPress(ZLimit): #button pressed once. need to move forward and back again to ensure correct start position
-            MoveZ(ZFORWARD,1200,FAST) #move forward -- at least 1k b/c neg range
-            for j in range(1400): #move back and check again
-                if CheckPress(ZLimit): #again
-                    
-                    MoveZ(ZBACKWARD, 1000, FAST) #START AT MINIMUM RANGE for easier calculating
-
-                    print('Optical switch has been tripped after {} steps!'.format(i))
-                    print('was already homed check: took {} out of 1200 steps on the second bounce'.format(j))
-                    
-                    
-                    GlobalZ = 0
-                    ZPosition.configure(text="Z: "+str(GlobalZ) + "/" + str(ZMax))
-                    return (i) #break away essentially
-                MoveZ(ZBACKWARD,1,FAST)
-            #do stepping protocol (second in case button already pressed)
-        MoveZ(ZBACKWARD,1,FAST)#dir dis delay
+    MoveZ(ZBACKWARD, 1000, FAST) #START AT MINIMUM RANGE for easier calculating
+
+    print('Optical switch has been tripped after {} steps!'.format(i))
+    print('was already homed check: took {} out of 1200 steps on the second bounce'.format(j))
+    
+    GlobalZ = 0
+    schedule_pos_update()
+    return (i)
    
+def _fill_scan(xgrid, ygrid, zgrid, rgrid, out):
+    '''writes every scan point straight into out (N by 4, X Y Z R), same order as DefineScan's numpy version.
+    Each row is worked out from its own index so the loop can be split up across cores'''
+    
+    nx = len(xgrid)
+    nxy = nx*len(ygrid)
+    nxyz = nxy*len(zgrid)
+    for idx in prange(out.shape[0]):
+        row = (idx % nxy) // nx
+        col = idx % nx
+        if row % 2 == 1: #serpentine, odd rows go backwards
+            col = nx - 1 - col
+        out[idx, 0] = xgrid[col]
+        out[idx, 1] = ygrid[row]
+        out[idx, 2] = zgrid[(idx // nxy) % len(zgrid)]
+        out[idx, 3] = rgrid[idx // nxyz]
+
+fill_scan = njit(parallel=True, cache=True)(_fill_scan) if njit is not None else None
+
+@dataclass
+class ScanConfig:
+    '''the arguments to DefineScan, so a restart can make the same scan again'''
+    XMin: int
+    XMax: int
+    YMin: int
+    YMax: int
+    ZMin: int = 0
+    ZMax: int = 0
+    RMin: int = 0
+    RMax: int = 0
+    XSteps: int = 100
+    YSteps: int = 100
+    ZSteps: int = 1
+    RSteps: int = 1
+
 def DefineScan(XMin, XMax, YMin, YMax, ZMin=0, ZMax=0, RMin=0, RMax=0, XSteps=100, YSteps=100, ZSteps=1, RSteps=1):
     """
-    Used to generate a dictionary with four keys, each of which maps to a list containing
-    the absolute positions of X,Y,Z, and R, for every point of a scan.
+    Used to generate an (N,4) int32 array, one row per point of a scan holding
+    the absolute positions of X,Y,Z, and R.
     So if you don't want to move Z and R, just for instance set Zmin=Zmax=0 and ZSteps = 1.
  
     Core, of 2-axis control, from stack exchange. https://stackoverflow.com/questions/20872912/raster-scan-pattern-python
@@ -444,21 +979,24 @@ def DefineScan(XMin, XMax, YMin, YMax, ZMin=0, ZMax=0, RMin=0, RMax=0, XSteps=10
     
     
     # define some grids
-    xgrid = arange(XMin, XMax,XSteps) 
-    ygrid = arange(YMin, YMax,YSteps)
-    zgrid = arange(ZMin, ZMax, ZSteps)
-    rgrid = arange(RMin,RMax,RSteps)
+    xgrid = np.arange(XMin, XMax,XSteps) 
+    ygrid = np.arange(YMin, YMax,YSteps)
+    zgrid = np.arange(ZMin, ZMax, ZSteps)
+    rgrid = np.arange(RMin,RMax,RSteps)
     
-    xscan = []
-    yscan = []
-
-    for i, yi in enumerate(ygrid):
-        xscan.append(xgrid[::(-1)**i]) # reverse when i is odd
-        yscan.append(ones_like(xgrid) * yi)   
+    npoints = len(xgrid)*len(ygrid)*len(zgrid)*len(rgrid)
+    out = np.empty((npoints, 4), dtype=np.int32) #positions are whole steps anyway, and int32 keeps it small
+    if fill_scan is not None and npoints >= NUMBA_MIN_POINTS: #no temporaries at all
+        fill_scan(xgrid, ygrid, zgrid, rgrid, out)
+        return out
+    
+    # one row of X per Y, with every odd row reversed (serpentine)
+    xrows = np.broadcast_to(xgrid, (len(ygrid), len(xgrid))).copy()
+    xrows[1::2] = xrows[1::2, ::-1]
 
-    # squeeze lists together to vectors
-    xscan = concatenate(xscan)
-    yscan = concatenate(yscan)
+    # squeeze rows together to vectors
+    xscan = xrows.ravel()
+    yscan = np.repeat(ygrid, len(xgrid))
     
     """up until this, it works just fine for x/y. I am adding 
     my own code to account for Z now. Not efficient if there are a LOT of Z changes 
@@ -466,59 +1004,70 @@ def DefineScan(XMin, XMax, YMin, YMax, ZMin=0, ZMax=0, RMin=0, RMax=0, XSteps=10
     
     """
     
-    NewXScan = []
-    NewYScan = []
-    NewZScan = []
-    
-    
-    for i in range(len(zgrid)):
-        for j in range(len(xscan)):
-        
-            NewXScan.append(xscan[j])
-            NewYScan.append(yscan[j])
-            NewZScan.append(zgrid[i]) #note i not j
-        
-    #Repeat for change in rotation
+    #every Z plane gets the whole X/Y raster, then every rotation gets all the Z planes
+    xyzx = np.tile(xscan, len(zgrid))
+    xyzy = np.tile(yscan, len(zgrid))
+    xyzz = np.repeat(zgrid, len(xscan))
+    
+    out[:,0] = np.tile(xyzx, len(rgrid))
+    out[:,1] = np.tile(xyzy, len(rgrid))
+    out[:,2] = np.tile(xyzz, len(rgrid))
+    out[:,3] = np.repeat(rgrid, len(xyzx))
+    return(out)
+
+
+def _write_synced(path, data):
+    '''writes data (bytes, or an array, anything with the buffer protocol) straight from its own memory with os.write,
+    then fsyncs, since the reboot comes right after. No file object, no copies.
+    Goes to path.tmp first and gets renamed over path, so a crash halfway leaves the old file, never half a new one'''
+    mv = memoryview(data).cast('B')
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while mv: #os.write can come back short on big buffers
+            mv = mv[os.write(fd, mv):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+def GridScan(config,conditions='default'):
+    
+    """the main loop that carries out an actual scan. Accepts a ScanConfig, and an optional dictionary of conditions,
+ which is necessary when performing a restart in the middle of the scan. The points come from DefineScan(config) every time,
+ a restart just skips the ones it already did. Everything in the gui but ABORT is greyed out until it's done """
+    
+    if _scanning: #SCAN!!! got hit again from inside one of _wait_for's win.update()s
+        print('already scanning')
+        return
+    _lock_controls(True)
+    try:
+        _grid_scan(config, conditions)
+    finally:
+        _lock_controls(False)
 
-    NewNewXScan = [] #I seriously hope nobody ever reads these variable names
-    NewNewYScan = []
-    NewNewZScan = []
-    NewNewRScan = []
+def _grid_scan(config, conditions):
     
-    for i in range(len(rgrid)):
-        for j in range(len(NewXScan)):
-            NewNewXScan.append(NewXScan[j])
-            NewNewYScan.append(NewYScan[j])
-            NewNewZScan.append(NewZScan[j])
-            NewNewRScan.append(rgrid[i])
+    global GlobalR
     
-    ScanLocations = {'X':NewNewXScan,'Y':NewNewYScan,'Z':NewNewZScan,'R':NewNewRScan}
-    return(ScanLocations)
-
-
-def GridScan(ScanLocations,conditions='default'):
+    points = DefineScan(**asdict(config)) #one row of X Y Z R per point in scan
+    start = 0 if conditions == 'default' else conditions['index'] #first picture we still need
     
-    """the main loop that carries out an actual scan. Accepts the dictionary output of DefineScan, and an optional dictionary of conditions,
- which is necessary when performing a restart in the middle of the scan. """
-     
-    XCoord = ScanLocations['X'] #simple list of axis location at each point in scan
-    YCoord = ScanLocations['Y']
-    ZCoord = ScanLocations['Z']
-    RCoord = ScanLocations['R']
+    uR = np.unique(points[:,3]) #sorted distinct rotations, one pass. Whole scan, so names don't change after a restart
+    points = points[start:]
     
-    start_time = time.time()
+    start_time = time.time() #wall clock on purpose, this one gets saved and has to mean something after a reboot
     
     if conditions == 'default': #usually the case!
+        GlobalR = 0 #R has no endstop, so wherever you turned the sample to is zero (see MoveR). A restart gets it from conditions
         save_location = filedialog.askdirectory() #pop up screen asking where to save files like flash drive
         filetype = ".jpg" #jpgs are honestly ok too and might make things easier/faster #NOTE CHANGED FROM PNG DEC 16 2019
         resolution = "640x480" #for crappy microscope, not necessarily reliable, though
         timeallowed = 30 #number of seconds you have to save the scan if the USB is failing before auto restart!
         num_failures = 0 #times restarted so far
-        original_pics = len(XCoord) 
+        original_pics = len(points) 
         original_time = start_time
-        original_locations = ScanLocations
-        failed_pics=[] #keeps track of which pic we were on when restart happens
-        failure_times=[] #keeps track of when failure happens
+        log_mode = 'w' #new scan, new log. Only opened when something fails, so there's no handle to leak
         
     else: #generally, inputted automatically after a restart
         save_location = conditions['save_location']
@@ -526,139 +1075,150 @@ def GridScan(ScanLocations,conditions='default'):
         resolution = conditions['resolution']
         timeallowed=0 #after one restart we don't bother trying to save scan.
         num_failures=conditions['num_failures']
-        failed_pics=conditions['failed_pics']
-        failure_times=conditions['failure_times']
+        log_mode = 'a' #failure history is only in FAILURE_LOG_FILE now, nothing here needs it back
         original_pics=conditions['original_pics']
         original_time=conditions['original_time']
-        original_locations=conditions['original_locations']
         
-    num_pictures = len(XCoord) #remaining pics, not originally
-    NumberOfRotations = len(set(RCoord)) #1 means no rotation
-    stepsPerRotation = ((max(RCoord)-min(RCoord))/len(set(RCoord)))
+    num_pictures = len(points) #remaining pics, not originally
+    NumberOfRotations = uR.size #1 means no rotation
+    stepsPerRotation = ((uR[-1]-uR[0])/uR.size)
     
     #print("Rotating {} per image".format(str(StepsPerRotation))) #for debugging
     print("has failed and restarted {} times so far".format(str(num_failures)))
     
-    #Initialize locations
+    #the parts of the restart file that never change during a scan, failures just add the rest
+    base_conditions = {'config':asdict(config),
+                       'save_location':save_location,
+                       'filetype':filetype,
+                       'resolution':resolution,
+                       'original_pics':original_pics,
+                       'original_time':original_time}
+    
+    recent_timeouts = deque(maxlen=TIMEOUT_BURST) #camera timeouts only restart if this many come within TIMEOUT_WINDOW
+    
+    def checkpoint(k, name):
+        '''picture k (in points) didn't make it. Logs it, saves where to pick up and restarts'''
+        nonlocal num_failures
+        num_failures +=1
+        
+        with open(FAILURE_LOG_FILE, log_mode) as fail_log: #which picture and when, for looking at afterwards
+            fail_log.write(f"{name}\t{time.time()}\n") #one line, instead of rewriting the whole history every time
+            fail_log.flush()
+            os.fsync(fail_log.fileno())
+        
+        conditions = {**base_conditions,
+                      'index':start + k, #where to pick up, counted in the whole scan
+                      'R_Location':GlobalR, #where R really is, not points[k]. A lost picture can be from a plane ago
+                      'num_failures':num_failures} #after restart because no gui timeout after 0 seconds
+            
+        log.debug("checkpoint: picture %d of %d, %d failures", start + k, original_pics, num_failures)
+        
+        #everything in conditions is plain numbers and strings. Sorry about the hardcoded location, see SCAN_DATA_FILE
+        _write_synced(SCAN_DATA_FILE, json.dumps(conditions).encode()) #instead of the old sleep(2), on the disk for real before we reboot
+        
+        log.info('restarting sorryyyyyy')
+            
+        restart()
     
-    XGoTo(int(XCoord[0]))
-    YGoTo(int(YCoord[0]))
-    ZGoTo(int(ZCoord[0]))
-    RGoTo(int(RCoord[0]))
+    def lost_name():
+        '''checkpoint takes the earliest lost picture, this is its name'''
+        x, y, z, r = points[min(lost_pics)].tolist()
+        return f"X{x:04d}Y{y:04d}Z{z:04d}R{r:03d}of{NumberOfRotations:03d}{filetype}"
     
+    lost_pics.clear()
+    capture = StartCaptureWorker(resolution)
+    retry_pool = ThreadPoolExecutor(max_workers=1) #one thread, pictures still go one at a time
+    abort_event.clear()
+    try:
+        
+        #Initialize locations
+        
+        MoveTo(*points[0].tolist())
+        
+        made_folders = set()
+        last_z = None #folder only changes with Z and R
+        last_r = None
     
+        for i in range(num_pictures):
+        
+            x, y, z, r = points[i].tolist() #plain ints, one conversion per point instead of an int() per use
         
-    for i in range(num_pictures):
+            if abort_event.is_set(): #checked here too, not just while a retry is waiting
+                break
         
-        #beep!
-        if i % 100 == 0: #Should be percentage of remaining but this is ok
-            print("{} of {} pictures remaining".format((num_pictures-i),original_pics))
-            GPIO.output(BEEP,GPIO.HIGH) 
-            time.sleep(0.3) #can eliminate if you're pinching seconds
-            GPIO.output(BEEP,GPIO.LOW)
+            #beep!
+            if i % 100 == 0: #Should be percentage of remaining but this is ok
+                print("{} of {} pictures remaining".format((num_pictures-i),original_pics))
+                beep_async(0.3) #beeps while we move to the next point
             
-        #make new folder every time you change Z and R:
-        folder = save_location + "/Z" + str(ZCoord[i]).zfill(4) + "R" + str(RCoord[i]).zfill(3) 
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+            #make new folder every time you change Z and R:
+            if z != last_z or r != last_r: #only changes at plane boundaries, so only rebuild then
+                last_z = z
+                last_r = r
+                zr_key = f"Z{last_z:04d}R{last_r:03d}"
+                folder = save_location + "/" + zr_key
+                if folder not in made_folders: #only hit the disk once per folder
+                    os.makedirs(folder, exist_ok=True)
+                    made_folders.add(folder)
                 
             
-        #go to locations                    
-        XGoTo(int(XCoord[i]))
-        YGoTo(int(YCoord[i]))
-        ZGoTo(int(ZCoord[i]))
-        RGoTo(int(RCoord[i]))
+            #go to locations                    
+            MoveTo(x, y, z, r)
             
-        time.sleep(0.2) #VIBRATION CONTROL! (increased from 0.1 to 0.2 for high res)
+            time.sleep(0.2) #VIBRATION CONTROL! (increased from 0.1 to 0.2 for high res)
                
             
             
-        name = "X" + str(XCoord[i]).zfill(4) + "Y" + str(YCoord[i]).zfill(4) + "Z" + str(ZCoord[i]).zfill(4) + "R" + str(RCoord[i]).zfill(3) + "of" + str(NumberOfRotations).zfill(3) + filetype
+            name = f"X{x:04d}Y{y:04d}{zr_key}of{NumberOfRotations:03d}{filetype}"
 
-        """begin filesaving block"""
+            """begin filesaving block"""
         
-        try: #Largely, problems are due to USB disconnecting or just not being in.
-            for w in range(3): #try to take pic with fswebcam
-                
-                proc = subprocess.Popen(["fswebcam", "-r " + resolution, "--no-banner", folder + "/" + name, "-q"], stdout=subprocess.PIPE) #like check_call(infinite timeout)
-                output = proc.communicate(timeout=10)[0]
-                
-                if os.path.isfile(folder + "/" + name): #check if file was created 
-                    if w > 0: #AKA, USB was broken but fixed in time
-                        print ('Okay thanks bozo. Restarting with {}'.format(name))
-                        
-                    break #move on to next picture
-                
-                elif (w <= 1): #usb got unplugged aaaaggghhhhh
-                
-                    #attempt to catch USB from https://stackoverflow.com/questions/1335507/keyboard-input-with-timeout-in-python  
-                    print('HEY BOZO THE USB GOT UNPLUGGED UNPLUG IT AND PLUG IT BACK IN WITHIN {} SECONDS OR WE REBOOT'.format(timeallowed))
-                    print('check if {} failed'.format(name))
-                
-                    GPIO.output(BEEP,GPIO.HIGH) #beep and bibrate
-                
-                    time.sleep(timeallowed) #Sorry, it will beep the full time, even if you restart it immediately
-                
-                    GPIO.output(BEEP,GPIO.LOW)
-                
-                else: #Begin saving current scan data for restart. This could be reworked for periodic backup
-                    UpdatedX = XCoord[i:]
-                    UpdatedY = YCoord[i:]
-                    UpdatedZ = ZCoord[i:]
-                    UpdatedR = RCoord[i:]
-                    
-                    UpdatedScanLocations = {'X':UpdatedX, 'Y':UpdatedY, 'Z': UpdatedZ,'R':UpdatedR}
-                    
-                    num_failures +=1
-                    
-                    failed_pics.append(name)
-                    failure_times.append(time.time())
-                    
-                    conditions = {'save_location':save_location,
-                                  'R_Location':int(RCoord[i]),
-                                  'filetype':filetype,
-                                  'resolution':resolution,
-                                  'num_failures':num_failures,
-                                  'original_pics':original_pics,
-                                  'original_time':original_time,
-                                  'original_locations':original_locations,
-                                  'failed_pics':failed_pics,
-                                  'failure_times':failure_times} #after restart because no gui timeout after 0 seconds
-                        
-                    scan_params = [UpdatedScanLocations,conditions]
-                    print(scan_params) #for debugging if sitting there
-                    time.sleep(2)
-                    
-                    scan_file = open('/home/pi/Desktop/ladybug/scandata.pkl', 'wb') #SCAN DATA LOCATION HARDCODED ONTO DESKTOP
-                    #Sorry about this, but it's because the auto restart cron script needs to know where to look. 
-                         
-                    pickle.dump(scan_params,scan_file)
-                    scan_file.close()
-                    
-                    print('restarting sorryyyyyy')
-                        
-                    restart()
-                        
-        except subprocess.TimeoutExpired: #does not catch USB UNPLUG. Catches if it takes too long because of lag. Rarely happens
-    
-            print ("{} failed :( ".format(name))
-            proc.terminate() #corrective measure?
-            continue #move on. In true loop, it keeps trying the same picture since it shouldn't matter which one
-
-            
-            
-    print ('scan completed successfully after {} seconds! {} images taken and {} restarts'.format
-           (time.strftime("%H:%M:%S", time.gmtime(time.time() - original_time)), str(original_pics),str(num_failures)))
+            while True: #Largely, problems are due to USB disconnecting or just not being in.
+                try:
+                    ok = _wait_for(retry_pool.submit(capture_with_retry, capture, i, folder + "/" + name, timeallowed))
+                    break
+                except subprocess.TimeoutExpired: #does not catch USB UNPLUG. Catches if it takes too long because of lag. Rarely happens
+                    print ("{} failed :( ".format(name))
+                    recent_timeouts.append(time.monotonic_ns())
+                    if len(recent_timeouts) == TIMEOUT_BURST and recent_timeouts[-1] - recent_timeouts[0] < TIMEOUT_WINDOW*1000000000:
+                        ok = False #lagging this much isn't going to fix itself, restart like the USB was gone
+                        break
+                    if abort_event.is_set():
+                        ok = None
+                        break
+                    #otherwise just try the same picture again, we're already there
+        
+            if ok is None: #aborted from the gui
+                break
+        
+            if not ok: #Begin saving current scan data for restart. This could be reworked for periodic backup
+                checkpoint(i, name)
+        
+            if lost_pics: #an earlier picture got taken but never written, go back for it (and redo the ones after, oh well)
+                checkpoint(min(lost_pics), lost_name())
+    
+    finally: #whatever happened in there, don't leave the camera process and the thread running
+        StopCaptureWorker(capture) #picks up any last failed writes into lost_pics
+        retry_pool.shutdown()
+    
+    if abort_event.is_set(): #leave any scandata file alone in case you want to resume it
+        print('scan aborted at picture {} of {}'.format(i, num_pictures))
+        if lost_pics:
+            print('{} also failed to write, check it'.format(lost_name()))
+        return
+    
+    if lost_pics:
+        checkpoint(min(lost_pics), lost_name())
+    
+    elapsed = time.time() - original_time
+    print (f'scan completed successfully after {time.strftime("%H:%M:%S", time.gmtime(elapsed))}! {original_pics} images taken and {num_failures} restarts')
     try:
-        os.rename('/home/pi/Desktop/ladybug/scandata.pkl','/home/pi/Desktop/ladybug/scandataold.pkl') 
+        os.rename(SCAN_DATA_FILE,SCAN_DATA_OLD_FILE) 
       #if you don't rename this, it can form an infinite loop! Should rename to reflect scan data or something
     except FileNotFoundError: #meaning it never restarted and created scandata file
         pass
     
-    for i in range(5): #beep beep beep beep beep
-        GPIO.output(BEEP,GPIO.HIGH)
-        time.sleep(0.2)
-        GPIO.output(BEEP,GPIO.LOW)
+    beep_async(0.2, 0.2, 5) #beep beep beep beep beep
 
     a = input('press any key to exit') #hang to await confirmation scan completed if run in autoclosing shell
 
@@ -668,20 +1228,13 @@ def XRepeatTest(num_trials=100):
     """this will move a lot and then home, to check to make sure we're not skipping steps or something. 
     You can probably ignore this. """
   
-    HomeX()
-    HomeX() #twice just to make sure it's good
-    HomeX() #one more for good luck? 
+    HomeXVerified() #used to be three HomeX in a row just to make sure it's good
     global XMax
-    total_steps = 0
-    ranlocold = 0 #location old
-    ListOfLoc = [0] #include initial location
-    
-    for i in range(num_trials):
-        ranloc = random.randrange(100,XMax-100)
-        total_steps += (abs(ranlocold-ranloc))
-        ranlocold = ranloc
-        ListOfLoc.append(ranloc)
-        
+    ranlocs = np.random.randint(100, XMax-100, size=num_trials)
+    ListOfLoc = [0] + ranlocs.tolist() #include initial location
+    total_steps = int(np.abs(np.diff(ListOfLoc)).sum())
+    
+    for ranloc in ListOfLoc[1:]: #plain ints, XGoTo wants those
         XGoTo(ranloc)
     
     StepsToHome = HomeX() #first bounce
@@ -696,20 +1249,13 @@ def XRepeatTest(num_trials=100):
 def YRepeatTest(num_trials=100): 
     #same as X, you can probably ignore this or even remove entirely
   
-    HomeY()
-    HomeY() 
-    HomeY() #The first couple of homes are sometimes wonky
+    HomeYVerified() #The first couple of homes are sometimes wonky, this checks and redoes it if so
     global YMax
-    total_steps = 0
-    ranlocold = 0 #location old
-    ListOfLoc = [0] #include initial location
-    
-    for i in range(num_trials):
-        ranloc = random.randrange(100,YMax-100) #more than 0, less than max, in case misteps bring it to end of range
-        total_steps += (abs(ranlocold-ranloc))
-        ranlocold = ranloc
-        ListOfLoc.append(ranloc)
-        
+    ranlocs = np.random.randint(100, YMax-100, size=num_trials) #more than 0, less than max, in case misteps bring it to end of range
+    ListOfLoc = [0] + ranlocs.tolist() #include initial location
+    total_steps = int(np.abs(np.diff(ListOfLoc)).sum())
+    
+    for ranloc in ListOfLoc[1:]: #plain ints, YGoTo wants those
         YGoTo(ranloc)
     
     StepsToHome = HomeY() #first bounce
@@ -781,11 +1327,9 @@ def GuiScan():
   #that "SCAN!!!" button I never use
     #Note, just noticed that this isn't compatible with the new absolute value convention (being able to do partial R rotations).
     #Fix will be later; temporary is passing RMin = 0 RMax = StepsPerRotation.
-    #and Rsteps = StepsPerRotation/RScanNumber
-    RScanStep = 160/RScanNumber #Temporary conversion from number of times to move R, with amount of steps moved each time R is moved.
-    print(RScanStep)
+    #and Rsteps = StepsPerRotation/RScanNumber, which SetR already looked up as RScanStep
     
-    CallForGrid = DefineScan(XScanMin,XScanMax,YScanMin,YScanMax,ZScanMin,ZScanMax,RScanMin,StepsPerRotation,XScanStep,YScanStep,ZScanStep,RScanStep)
+    CallForGrid = ScanConfig(XScanMin,XScanMax,YScanMin,YScanMax,ZScanMin,ZScanMax,RScanMin,StepsPerRotation,XScanStep,YScanStep,ZScanStep,RScanStep)
                                         
     GridScan(CallForGrid)
     
@@ -793,7 +1337,9 @@ def GuiScan():
 def SetR():
     #gets entry from dropdown for rotations and passes to global variable 
     global RScanNumber
+    global RScanStep
     RScanNumber = int(RSetVar.get())
+    RScanStep = _RSTEP[RScanNumber] #conversion from number of times to move R, with amount of steps moved each time R is moved.
     print ('viewing {} points of view'.format(str(RScanNumber)))
     
 
@@ -860,434 +1406,271 @@ def MoveRCCWSmall(): #counterclockwise
     
 def exitProgram():
     print("Exit Button pressed")
+    if pi is not None:
+        pi.stop()
     GPIO.cleanup() 
     win.quit()
 
 #BUTTONS FOR SETTING SCAN PARAMETERS
 
-def SetXLowerBound():
-    global XScanMin
-    XScanMin = GlobalX
-    print("Lower Boundary for X Scan has been set to {}".format(XScanMin))
-
-def SetXUpperBound():
-    global XScanMax
-    XScanMax = GlobalX
-    print("Upper Boundary for X Scan has been set to {}".format(XScanMax))
-
-
-def SetYLowerBound():
-    global YScanMin
-    YScanMin = GlobalY
-    print("Lower Boundary for Y Scan has been set to {}".format(YScanMin))
-
-def SetYUpperBound():
-    global YScanMax
-    YScanMax = GlobalY
-    print("Upper Boundary for Y Scan has been set to {}".format(YScanMax))
-
-def SetZLowerBound():
-    #sets Z bound to whatever global Z is
-    global ZScanMin
-    ZScanMin = GlobalZ
-    print("Lower Boundary for Z Scan has been set to {}".format(ZScanMin))
-
-def SetZUpperBound():
-    global ZScanMax
-    ZScanMax = GlobalZ
-    print("Upper Boundary for Z Scan has been set to {}".format(ZScanMax))
-
-def SetZStep():
-    global ZScanStep
-    ZScanStep = GlobalZ #Yes I know I should be shot but this makes it more minimal. If want 100 stepsize, go to location 100 and press the button!
-    print("Step size for Z has been set to {}".format(ZScanStep))
-
-def SetXStep():
-    global XScanStep
-    XScanStep = GlobalX
-    print("Step size for X has been set to {}".format(YScanStep))
-    
-def SetYStep():
-    global YScanStep
-    YScanStep = GlobalY
-    print("Step size for Y has been set to {}".format(YScanStep))
-
-#Begin disgusting block of instructions for keypress. Complicated by fact we want to be able to hold Down.
-#Modified from https://stackoverflow.com/questions/12994796/how-can-i-control-keyboard-repeat-delay-in-a-tkinter-root-window
-#main changes are not displaying the Label and also only enabling key control when checkbox is checked (allow_keypress)
-#works okay for hitton the key once but not so much for holding it down.  
-
-
-def LeftStep(*event): #X
-    MoveYForwardSmall()
-    
-    if LeftLabel._repeat_on:
-        win.after(LeftLabel._repeat_freq, LeftStep)
-
-def LeftStop(*event):
-    if LeftLabel._repeat_on:
-        LeftLabel._repeat_on = False
-        win.after(LeftLabel._repeat_freq + 1, LeftStop)
-    else:
-        LeftLabel._repeat_on = True
-
-
-def RightStep(*event):
-    MoveYBackSmall()
-
-    if RightLabel._repeat_on:
-        win.after(RightLabel._repeat_freq, RightStep)
-
-def RightStop(*event):
-    if RightLabel._repeat_on:
-        RightLabel._repeat_on = False
-        win.after(RightLabel._repeat_freq + 1, RightStop)
-    else:
-        RightLabel._repeat_on = True
-
-
-def UpStep(*event):
-    MoveXLeftSmall()
-
-    if UpLabel._repeat_on:
-        win.after(UpLabel._repeat_freq, UpStep)
-
-def UpStop(*event):
-    if UpLabel._repeat_on:
-        UpLabel._repeat_on = False
-        win.after(UpLabel._repeat_freq + 1, UpStop)
-    else:
-        UpLabel._repeat_on = True
-
-def DownStep(*event):
-    MoveXRightSmall()
-
-    if DownLabel._repeat_on:
-        win.after(DownLabel._repeat_freq, DownStep)
-
-def DownStop(*event):
-    if DownLabel._repeat_on:
-        DownLabel._repeat_on = False
-        win.after(DownLabel._repeat_freq + 1, DownStop)
-    else:
-        DownLabel._repeat_on = True
-
-def AStep(*event): #note actual lowercase. FOr clock and counterclockwise rotation
-    MoveRCCWSmall()
-
-    if ALabel._repeat_on:
-        win.after(ALabel._repeat_freq, AStep)
-
-def AStop(*event):
-    if ALabel._repeat_on:
-        ALabel._repeat_on = False
-        win.after(ALabel._repeat_freq + 1, AStop)
-    else:
-        ALabel._repeat_on = True
-
-def DStep(*event): #note actual lowercase. FOr clock and counterclockwise rotation
-    MoveRCWSmall()
-
-    if DLabel._repeat_on:
-        win.after(DLabel._repeat_freq, DStep)
-
-def DStop(*event):
-    if DLabel._repeat_on:
-        DLabel._repeat_on = False
-        win.after(DLabel._repeat_freq + 1, DStop)
-    else:
-        DLabel._repeat_on = True
-
-def WStep(*event): #note actual lowercase. For Z AXIS W and S
-    MoveZUpSmall()
-
-    if WLabel._repeat_on:
-        win.after(WLabel._repeat_freq, WStep)
-
-def WStop(*event):
-    if WLabel._repeat_on:
-        WLabel._repeat_on = False
-        win.after(WLabel._repeat_freq + 1, WStop)
-    else:
-        WLabel._repeat_on = True
-
-def SStep(*event): #note actual lowercase. For Z AXIS S and S
-    MoveZDownSmall()
-
-    if SLabel._repeat_on:
-        win.after(SLabel._repeat_freq, SStep)
-
-def SStop(*event):
-    if SLabel._repeat_on:
-        SLabel._repeat_on = False
-        win.after(SLabel._repeat_freq + 1, SStop)
-    else:
-        SLabel._repeat_on = True
-
+def _make_setter(name, getter, message):
+    '''makes a button command that sets the global called name to getter(), wherever that axis is right now'''
+    def setter():
+        globals()[name] = getter()
+        print(message.format(globals()[name]))
+    return setter
+
+SetXLowerBound = _make_setter('XScanMin', lambda: GlobalX, "Lower Boundary for X Scan has been set to {}")
+SetXUpperBound = _make_setter('XScanMax', lambda: GlobalX, "Upper Boundary for X Scan has been set to {}")
+SetYLowerBound = _make_setter('YScanMin', lambda: GlobalY, "Lower Boundary for Y Scan has been set to {}")
+SetYUpperBound = _make_setter('YScanMax', lambda: GlobalY, "Upper Boundary for Y Scan has been set to {}")
+SetZLowerBound = _make_setter('ZScanMin', lambda: GlobalZ, "Lower Boundary for Z Scan has been set to {}")
+SetZUpperBound = _make_setter('ZScanMax', lambda: GlobalZ, "Upper Boundary for Z Scan has been set to {}")
+#Steps too. Yes I know I should be shot but this makes it more minimal. If want 100 stepsize, go to location 100 and press the button!
+SetXStep = _make_setter('XScanStep', lambda: GlobalX, "Step size for X has been set to {}")
+SetYStep = _make_setter('YScanStep', lambda: GlobalY, "Step size for Y has been set to {}")
+SetZStep = _make_setter('ZScanStep', lambda: GlobalZ, "Step size for Z has been set to {}")
+
+#Begin block of instructions for keypress. Complicated by fact we want to be able to hold Down.
+#Used to be one self-rescheduling timer per key, from https://stackoverflow.com/questions/12994796/how-can-i-control-keyboard-repeat-delay-in-a-tkinter-root-window
+#now press/release just keep track of which keys are down and one tick moves for all of them.
+#Only enabled when checkbox is checked (allow_keypress)
+
+
+_KEY_PRESS = {'Left': MoveYForwardSmall, #what each key does, looked up by _on_press
+              'Right': MoveYBackSmall,
+              'Up': MoveXLeftSmall,
+              'Down': MoveXRightSmall,
+              'a': MoveRCCWSmall, #note actual lowercase. For clock and counterclockwise rotation
+              'd': MoveRCWSmall,
+              'w': MoveZUpSmall, #Z AXIS W and S
+              's': MoveZDownSmall}
+KEY_TICK_MS = 20 #50 Hz. The moves themselves take longer than that, so in practice it's as fast as the motors go
+KEY_RELEASE_MS = 30 #X11 autorepeat sends a release and a press for every repeat, a release only counts if no press follows this quick
+_held = set() #keys that are down right now
+_tick_id = None
+_release_ids = {} #key -> pending _release, see _on_release
+
+def _key_tick():
+    global _tick_id
+    
+    if not _scanning: #keeps ticking, just doesn't move anything
+        for key in tuple(_held):
+            _KEY_PRESS[key]()
+    _tick_id = win.after(KEY_TICK_MS, _key_tick)
+
+def _on_press(event):
+    if event.keysym in _release_ids: #just autorepeat, it never really went up
+        win.after_cancel(_release_ids.pop(event.keysym))
+        return
+    if event.keysym in _KEY_PRESS and not _scanning: #anything else, like typing a number in an entry, is none of our business
+        if event.keysym not in _held: #new press moves right away, a tap quicker than KEY_TICK_MS would get lost otherwise
+            _held.add(event.keysym) #a set, so the keyboard's own autorepeat doesn't stack up
+            _KEY_PRESS[event.keysym]()
+
+def _on_release(event):
+    if event.keysym in _held:
+        _release_ids[event.keysym] = win.after(KEY_RELEASE_MS, _release, event.keysym)
+
+def _release(key):
+    del _release_ids[key]
+    _held.discard(key)
 
 def allow_keypress():
-    #Checks if button is presed, if so, allows keycontrol
+    #Checks if button is presed, if so, allows keycontrol. One binding each for press and release, _on_press sorts out the key
+    
+    global _press_bound
+    global _release_bound
+    global _tick_id
     
     if keypress_var.get(): #I can't believe this works. Button is pressed
-        
-        
-        global Leftbound
-        global Leftunbound
-        global Rightbound
-        global Rightunbound
-        global Upbound
-        global Upunbound
-        global Downbound
-        global Downunbound
-        global Abound
-        global Aunbound
-        global Dbound
-        global Dunbound
-        global Wbound
-        global Wunbound
-        global Sbound
-        global Sunbound
-        
-        
-        
-        
-        Leftbound = win.bind('<KeyPress-Left>', LeftStep)
-        Leftunbound = win.bind('<KeyRelease-Left>', LeftStop)
-        Rightbound = win.bind('<KeyPress-Right>', RightStep)
-        Rightunbound = win.bind('<KeyRelease-Right>', RightStop)
-        Upbound = win.bind('<KeyPress-Up>', UpStep)
-        Upunbound = win.bind('<KeyRelease-Up>', UpStop)
-        Downbound = win.bind('<KeyPress-Down>', DownStep)
-        Downunbound = win.bind('<KeyRelease-Down>', DownStop)
-        Abound = win.bind('<KeyPress-a>', AStep)
-        Aunbound = win.bind('<KeyRelease-a>', AStop)
-        Dbound = win.bind('<KeyPress-d>', DStep)
-        Dunbound = win.bind('<KeyRelease-d>', DStop)
-        Wbound = win.bind('<KeyPress-w>', WStep)
-        Wunbound = win.bind('<KeyRelease-w>', WStop)
-        Sbound = win.bind('<KeyPress-s>', SStep)
-        Sunbound = win.bind('<KeyRelease-s>', SStop)
+        _press_bound = win.bind('<KeyPress>', _on_press)
+        _release_bound = win.bind('<KeyRelease>', _on_release)
+        if _tick_id is None:
+            _key_tick()
         
     else:
-        win.unbind('<KeyPress-Left>', Leftbound)
-        win.unbind('<KeyRelease-Left>', Leftunbound)
-        win.unbind('<KeyPress-Right>', Rightbound)
-        win.unbind('<KeyRelease-Right>', Rightunbound)
-        win.unbind('<KeyPress-Up>', Upbound)
-        win.unbind('<KeyRelease-Up>', Upunbound)
-        win.unbind('<KeyPress-Down>', Downbound)
-        win.unbind('<KeyRelease-Down>', Downunbound)
-        win.unbind('<KeyPress-a>', Abound)
-        win.unbind('<KeyRelease-a>', Aunbound)   
-        win.unbind('<KeyPress-d>', Dbound)
-        win.unbind('<KeyRelease-d>', Dunbound)   
-        win.unbind('<KeyPress-w>', Wbound)
-        win.unbind('<KeyRelease-w>', Wunbound)   
-        win.unbind('<KeyPress-s>', Sbound)
-        win.unbind('<KeyRelease-s>', Sunbound)
+        win.unbind('<KeyPress>', _press_bound)
+        win.unbind('<KeyRelease>', _release_bound)
+        if _tick_id is not None:
+            win.after_cancel(_tick_id)
+            _tick_id = None
+        for release_id in _release_ids.values():
+            win.after_cancel(release_id)
+        _release_ids.clear()
+        _held.clear()
 
 #BEGIN WHAT GOES ONSCREEN. Someone who knows Tkinter, please fix this. I've forgotten what everything does. 
 
-win.title("Raspberry Pi GUI")
-win.geometry('1400x880')
-
-LeftFrame = tk.Frame(win)
-LeftFrame.pack(side = tk.LEFT)
-
-RightFrame = tk.Frame(win)
-RightFrame.pack(side = tk.RIGHT)
-
-TopFrame = tk.Frame(win)
-TopFrame.pack(side = tk.TOP)
-
-BottomFrame = tk.Frame(win)
-BottomFrame.pack(side = tk.BOTTOM)
-
-XStepButton = tk.Button(LeftFrame, text = "Set XScan Stepsize ", font = myFont, command = SetXStep, height = 1, width =20 )
-XStepButton.pack(side = tk.TOP, pady=5)
-XLowerBoundButton = tk.Button(LeftFrame, text = "Set XScan Min", font = myFont, command = SetXLowerBound, height = 1, width =20 )
-XLowerBoundButton.pack(side = tk.TOP, pady=5)
-XUpperBoundButton = tk.Button(LeftFrame, text = "Set XScan Max", font = myFont, command = SetXUpperBound, height = 1, width =20 )
-XUpperBoundButton.pack(side = tk.TOP, pady=5)
-
-YStepButton = tk.Button(TopFrame, text = "Set YScan Stepsize ", font = myFont, command = SetYStep, height = 1, width =20 )
-YStepButton.pack(side = tk.BOTTOM, pady=5)
-YUpperBoundButton = tk.Button(TopFrame, text = "Set YScan Max ", font = myFont, command = SetYUpperBound, height = 1, width =20 )
-YUpperBoundButton.pack(side = tk.BOTTOM, pady=5)
-YLowerBoundButton = tk.Button(TopFrame, text = "Set YScan Min ", font = myFont, command = SetYLowerBound, height = 1, width =20 )
-YLowerBoundButton.pack(side = tk.BOTTOM, pady=5)
-
-
-
-
-ZStepButton = tk.Button(RightFrame, text = "Set ZScan Stepsize ", font = myFont, command = SetZStep, height = 1, width =20 )
-ZStepButton.pack(side = tk.TOP, pady=5)
-ZLowerBoundButton = tk.Button(RightFrame, text = "Set ZScan Min ", font = myFont, command = SetZLowerBound, height = 1, width =20 )
-ZLowerBoundButton.pack(side = tk.TOP, pady=5)
-ZUpperBoundButton = tk.Button(RightFrame, text = "Set ZScan Max ", font = myFont, command = SetZUpperBound, height = 1, width =20 )
-ZUpperBoundButton.pack(side = tk.TOP, pady=5)
-
-
-
-YPosition = tk.Label(TopFrame, font=(myFont), height = 2, width=12) #use a Label widget, not Text
-YPosition.pack(side = tk.TOP)
-
-YEntry = tk.Entry(TopFrame, width = 4)
-YEntry.bind('<Return>', YGet)
-YEntry.pack(side=tk.TOP)
-
-
-YForwardBigButton = tk.Button(TopFrame, text = "⇑", font = myFont, command = MoveYForwardBig, height = 1, width =2 )
-YForwardBigButton.pack(side = tk.TOP)
+_scanning = False #True while GridScan runs, see _lock_controls
+_scan_locked = [] #every button, entry and dropdown except ABORT, none of them should change anything mid scan. Filled by build_gui
 
-YForwardSmallButton = tk.Button(TopFrame, text = "↑", font = myFont, command = MoveYForwardSmall, height = 1, width =2 )
-YForwardSmallButton.pack(side = tk.TOP)
-
-YBackSmallButton = tk.Button(TopFrame, text = "↓", font = myFont, command = MoveYBackSmall, height = 1, width =2 )
-YBackSmallButton.pack(side = tk.TOP)
-
-YBackBigButton = tk.Button(TopFrame, text = "⇓", font = myFont, command = MoveYBackBig, height = 1, width =2 )
-YBackBigButton.pack(side = tk.TOP)
-
-
-#display position and provide entrybox
-XPosition = tk.Label(LeftFrame, font=(myFont), height = 2, width=12) #use a Label widget, not Text
-XPosition.pack(side = tk.LEFT)
-
-XEntry = tk.Entry(LeftFrame, width = 4)
-XEntry.bind('<Return>', XGet)
-XEntry.pack(side=tk.LEFT)
-
-XLeftBigButton = tk.Button(LeftFrame, text = "⟸", font = myFont, command = MoveXLeftBig, height = 1, width =2 )
-XLeftBigButton.pack(side = tk.LEFT)
-
-XLeftSmallButton = tk.Button(LeftFrame, text = "←", font = myFont, command = MoveXLeftSmall, height = 1, width =2 )
-XLeftSmallButton.pack(side = tk.LEFT)
-
-XRightSmallButton = tk.Button(LeftFrame, text = "→", font = myFont, command = MoveXRightSmall, height = 1, width =2 )
-XRightSmallButton.pack(side = tk.LEFT)
+def _lock_controls(locked):
+    '''greys out _scan_locked and stops the keyboard controls while a scan is going, so nothing moves the motors under it'''
+    global _scanning
+    
+    _scanning = locked
+    _held.clear()
+    for widget in _scan_locked:
+        widget.configure(state = tk.DISABLED if locked else tk.NORMAL)
 
-XRightBigButton = tk.Button(LeftFrame, text = "⟹", font = myFont, command = MoveXRightBig, height = 1, width =2 )
-XRightBigButton.pack(side = tk.LEFT)
+def _add_buttons(rows, font, height, width, pady=0):
+    '''makes and packs a button for each (frame, text, command, side) row, all the same size and font. Returns them'''
+    buttons = []
+    for frame, text, command, side in rows:
+        button = tk.Button(frame, text = text, font = font, command = command, height = height, width = width)
+        button.pack(side = side, pady = pady)
+        buttons.append(button)
+    return buttons
 
-ZPosition = tk.Label(RightFrame, font=(myFont), height = 2, width=12) #use a Label widget, not Text
-ZPosition.pack(side = tk.RIGHT)
+def build_gui():
+    
+    #Start Tkinter GUI window.
+    #May fork to a headless version of this with all Tkinter stuff removed,
+    #Since I think it adds a lot of bloat and not too much benefit.
+    
+    global win
+    global XPosVar, YPosVar, ZPosVar #read by _flush_pos_update
+    global RSetVar, keypress_var
+    
+    win = tk.Tk()
+    myFont = tk.font.Font(family='Helvetica', size=12, weight='bold')
+    myBigFont = tk.font.Font(family='Helvetica', size=20,weight='bold')
 
-ZEntry = tk.Entry(RightFrame, width = 4)
-ZEntry.bind('<Return>', ZGet)
-ZEntry.pack(side=tk.RIGHT)
+    win.title("Raspberry Pi GUI")
+    win.geometry('1400x880')
 
+    LeftFrame = tk.Frame(win)
+    LeftFrame.pack(side = tk.LEFT)
 
-ZUpBigButton = tk.Button(RightFrame, text = "Z⇑", font = myFont, command = MoveZUpBig, height = 1, width =2 )
-ZUpBigButton.pack(side = tk.RIGHT)
+    RightFrame = tk.Frame(win)
+    RightFrame.pack(side = tk.RIGHT)
 
-ZUpSmallButton = tk.Button(RightFrame, text = "Z↑", font = myFont, command = MoveZUpSmall, height = 1, width =2 )
-ZUpSmallButton.pack(side = tk.RIGHT)
+    TopFrame = tk.Frame(win)
+    TopFrame.pack(side = tk.TOP)
 
-ZDownSmallButton = tk.Button(RightFrame, text = "Z↓", font = myFont, command = MoveZDownSmall, height = 1, width =2 )
-ZDownSmallButton.pack(side = tk.RIGHT)
+    BottomFrame = tk.Frame(win)
+    BottomFrame.pack(side = tk.BOTTOM)
 
-ZDownBigButton = tk.Button(RightFrame, text = "Z⇓", font = myFont, command = MoveZDownBig, height = 1, width =2 )
-ZDownBigButton.pack(side = tk.RIGHT)
+    #scan setting buttons. Order matters, pack goes in the order they're made
+    _scan_locked.extend(_add_buttons([(LeftFrame, "Set XScan Stepsize ", SetXStep, tk.TOP),
+                  (LeftFrame, "Set XScan Min", SetXLowerBound, tk.TOP),
+                  (LeftFrame, "Set XScan Max", SetXUpperBound, tk.TOP),
+                  (TopFrame, "Set YScan Stepsize ", SetYStep, tk.BOTTOM),
+                  (TopFrame, "Set YScan Max ", SetYUpperBound, tk.BOTTOM),
+                  (TopFrame, "Set YScan Min ", SetYLowerBound, tk.BOTTOM),
+                  (RightFrame, "Set ZScan Stepsize ", SetZStep, tk.TOP),
+                  (RightFrame, "Set ZScan Min ", SetZLowerBound, tk.TOP),
+                  (RightFrame, "Set ZScan Max ", SetZUpperBound, tk.TOP)], myFont, 1, 20, pady=5))
 
-HomeXButton = tk.Button(BottomFrame, text = "HOME X", font = myFont, command = HomeX, height = 2, width =8 )
-HomeXButton.pack(side = tk.BOTTOM,pady=5)
+    YPosVar = tk.StringVar(value="Y: 0/"+str(YMax)) #label follows this, cheaper than configure(text=...)
+    YPosition = tk.Label(TopFrame, textvariable=YPosVar, font=(myFont), height = 2, width=12) #use a Label widget, not Text
+    YPosition.pack(side = tk.TOP)
 
-HomeYButton = tk.Button(BottomFrame, text = "HOME Y", font = myFont, command = HomeY, height = 2, width =8 )
-HomeYButton.pack(side = tk.BOTTOM,pady=5)
+    YEntry = tk.Entry(TopFrame, width = 4)
+    YEntry.bind('<Return>', YGet)
+    YEntry.pack(side=tk.TOP)
+    _scan_locked.append(YEntry) #typing a number moves there
 
-HomeZButton = tk.Button(BottomFrame, text = "HOME Z", font = myFont, command = HomeZ, height = 2, width =8 )
-HomeZButton.pack(side = tk.BOTTOM,pady=5)
 
+    _scan_locked.extend(_add_buttons([(TopFrame, "⇑", MoveYForwardBig, tk.TOP),
+                  (TopFrame, "↑", MoveYForwardSmall, tk.TOP),
+                  (TopFrame, "↓", MoveYBackSmall, tk.TOP),
+                  (TopFrame, "⇓", MoveYBackBig, tk.TOP)], myFont, 1, 2))
 
-RCWSmallButton = tk.Button(BottomFrame, text = "↻", font = myBigFont, command = MoveRCWSmall, height = 1, width = 2)
-RCWSmallButton.pack(side = tk.BOTTOM, pady=5)
 
-RCCWSmallButton = tk.Button(BottomFrame, text = "↺", font = myBigFont, command = MoveRCCWSmall, height = 1, width = 2)
-RCCWSmallButton.pack(side = tk.BOTTOM,pady=5)
+    #display position and provide entrybox
+    XPosVar = tk.StringVar(value="X: 0/"+str(XMax))
+    XPosition = tk.Label(LeftFrame, textvariable=XPosVar, font=(myFont), height = 2, width=12) #use a Label widget, not Text
+    XPosition.pack(side = tk.LEFT)
 
-ScanButton = tk.Button(BottomFrame, text = "SCAN!!!", font = myBigFont, command = GuiScan, height = 1, width = 20)
-ScanButton.pack(side = tk.TOP, pady=110)
+    XEntry = tk.Entry(LeftFrame, width = 4)
+    XEntry.bind('<Return>', XGet)
+    XEntry.pack(side=tk.LEFT)
+    _scan_locked.append(XEntry)
 
-SecondaryBottomFrame = tk.Frame(BottomFrame)
-SecondaryBottomFrame.pack(side=tk.TOP)
+    _scan_locked.extend(_add_buttons([(LeftFrame, "⟸", MoveXLeftBig, tk.LEFT),
+                  (LeftFrame, "←", MoveXLeftSmall, tk.LEFT),
+                  (LeftFrame, "→", MoveXRightSmall, tk.LEFT),
+                  (LeftFrame, "⟹", MoveXRightBig, tk.LEFT)], myFont, 1, 2))
 
-RSetVar = tk.StringVar(SecondaryBottomFrame) #holds contents of dropdown? 
-RSetVar.set(FactorsOf160[0])
-RSetButton = tk.Button(SecondaryBottomFrame, text = "Set number of rotations", font = myFont, command = SetR, height = 1, width = 20)
-RSetButton.pack(side = tk.LEFT, padx=5)
-RSetDropdown = tk.OptionMenu(SecondaryBottomFrame, RSetVar, *FactorsOf160)
-RSetDropdown.pack(side = tk.RIGHT, padx=5)
+    ZPosVar = tk.StringVar(value="Z: 0/"+str(ZMax))
+    ZPosition = tk.Label(RightFrame, textvariable=ZPosVar, font=(myFont), height = 2, width=12) #use a Label widget, not Text
+    ZPosition.pack(side = tk.RIGHT)
 
-keypress_var = tk.IntVar() #1 if button is pressed
-keypress_button = tk.Checkbutton(SecondaryBottomFrame, text="ENABLE KEYBOARD CONTROLS", variable=keypress_var, command=allow_keypress)
-keypress_button.pack(side = tk.RIGHT)
+    ZEntry = tk.Entry(RightFrame, width = 4)
+    ZEntry.bind('<Return>', ZGet)
+    ZEntry.pack(side=tk.RIGHT)
+    _scan_locked.append(ZEntry)
 
 
-LeftLabel = tk.Label(win)
-LeftLabel._repeat_freq = int(SLOW*1000*10) #holding Down key, milisecond per repeat.. Delay should be how long it actually takes to move
-LeftLabel._repeat_on = True
+    _scan_locked.extend(_add_buttons([(RightFrame, "Z⇑", MoveZUpBig, tk.RIGHT),
+                  (RightFrame, "Z↑", MoveZUpSmall, tk.RIGHT),
+                  (RightFrame, "Z↓", MoveZDownSmall, tk.RIGHT),
+                  (RightFrame, "Z⇓", MoveZDownBig, tk.RIGHT)], myFont, 1, 2))
 
-RightLabel = tk.Label(win)
-RightLabel._repeat_freq = int(SLOW*1000*10) 
-RightLabel._repeat_on = True
+    _scan_locked.extend(_add_buttons([(BottomFrame, "HOME X", HomeX, tk.BOTTOM),
+                  (BottomFrame, "HOME Y", HomeY, tk.BOTTOM),
+                  (BottomFrame, "HOME Z", HomeZ, tk.BOTTOM)], myFont, 2, 8, pady=5))
 
-UpLabel = tk.Label(win)
-UpLabel._repeat_freq = int(SLOW*1000*10) 
-UpLabel._repeat_on = True
+    _scan_locked.extend(_add_buttons([(BottomFrame, "↻", MoveRCWSmall, tk.BOTTOM),
+                  (BottomFrame, "↺", MoveRCCWSmall, tk.BOTTOM)], myBigFont, 1, 2, pady=5))
 
-DownLabel = tk.Label(win)
-DownLabel._repeat_freq = int(SLOW*1000*10)  
-DownLabel._repeat_on = True
+    ScanButton = tk.Button(BottomFrame, text = "SCAN!!!", font = myBigFont, command = GuiScan, height = 1, width = 20)
+    ScanButton.pack(side = tk.TOP, pady=110)
 
-ALabel = tk.Label(win) #a and d are rotation
-ALabel._repeat_freq = int(SLOW*1000*10)  
-ALabel._repeat_on = True
+    AbortButton = tk.Button(BottomFrame, text = "ABORT SCAN", font = myFont, command = AbortScan, height = 1, width = 20)
+    AbortButton.pack(side = tk.TOP, pady=5)
 
-DLabel = tk.Label(win)
-DLabel._repeat_freq = int(SLOW*1000*10)  
-DLabel._repeat_on = True
+    SecondaryBottomFrame = tk.Frame(BottomFrame)
+    SecondaryBottomFrame.pack(side=tk.TOP)
 
-WLabel = tk.Label(win)
-WLabel._repeat_freq = int(SLOW*1000*10)  
-WLabel._repeat_on = True
+    RSetVar = tk.StringVar(SecondaryBottomFrame) #holds contents of dropdown? 
+    RSetVar.set(FactorsOf160[0])
+    RSetButton = tk.Button(SecondaryBottomFrame, text = "Set number of rotations", font = myFont, command = SetR, height = 1, width = 20)
+    RSetButton.pack(side = tk.LEFT, padx=5)
+    RSetDropdown = tk.OptionMenu(SecondaryBottomFrame, RSetVar, *FactorsOf160)
+    RSetDropdown.pack(side = tk.RIGHT, padx=5)
 
-SLabel = tk.Label(win)
-SLabel._repeat_freq = int(SLOW*1000*10)  
-SLabel._repeat_on = True
+    keypress_var = tk.IntVar() #1 if button is pressed
+    keypress_button = tk.Checkbutton(SecondaryBottomFrame, text="ENABLE KEYBOARD CONTROLS", variable=keypress_var, command=allow_keypress)
+    keypress_button.pack(side = tk.RIGHT)
+    
+    _scan_locked.extend([ScanButton, RSetButton, RSetDropdown, keypress_button]) #AbortButton is the one thing that stays
 
 
-"""BEGIN MAIN LOOP, beginning with an attempt to resume scan if it detects that a previous one failed 
+def main():
+    
+    """BEGIN MAIN LOOP, beginning with an attempt to resume scan if it detects that a previous one failed 
 (existence of scandata file)"""
-
-
-try:
-    GPIO.output(BEEP,GPIO.HIGH)
-    time.sleep(0.1)
-    GPIO.output(BEEP,GPIO.LOW)
-    time.sleep(0.2)
-    GPIO.output(BEEP,GPIO.HIGH)
-    time.sleep(0.1)
-    GPIO.output(BEEP,GPIO.LOW)
+    
+    global GlobalR
+    
+    try:
+        beep_async(0.1, 0.2, 2) #hello, homing starts while it beeps
     
     
-    scan_file = open('/home/pi/Desktop/ladybug/scandata.pkl', 'rb')
-        
-    scan_params = pickle.load(scan_file)
-    scan_file.close()    
+        with open(SCAN_DATA_FILE, 'r') as scan_file: #closed even if the json turns out to be bad
+            conditions = json.load(scan_file) #save location, filetype, resolution, timeout, numfailures
             
-    HomeX() 
-    HomeY()
-    HomeZ()
+        HomeX() 
+        HomeY()
+        HomeZ()
     
-    locations = scan_params[0] #position data
-    conditions = scan_params[1] #save location, filetype, resolution, timeout, numfailures
+        config = ScanConfig(**conditions['config']) #GridScan makes the points again from this
     
-    GlobalR = conditions['R_Location'] #I'm worried that pins would flip here during restart. Likely a source of error
-    #But becasue R has no endstop we have to set it to what it was in the scan
+        GlobalR = conditions['R_Location'] #I'm worried that pins would flip here during restart. Likely a source of error
+        #But becasue R has no endstop we have to set it to what it was in the scan
 
-    GridScan(locations,conditions)
+        GridScan(config,conditions)
     
-except FileNotFoundError:
+    except FileNotFoundError:
         
-    print('No interrupted scans found. Welcome to the scanner.')
+        print('No interrupted scans found. Welcome to the scanner.')
+
+
+if __name__ == '__main__':
+    start_logging()
+    init_hardware()
+    build_gui()
+    main()